@@ -1,11 +1,195 @@
 from bs4 import BeautifulSoup
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 import argparse
 from pathlib import Path
 import logging
+import mmap
+import os
+import random
+import re
 import requests
+import threading
 import time
 
+# Bare http(s) URLs in markdown, plain text and prior content dumps. One level
+# of balanced parentheses is allowed so links like Wikipedia's `Foo_(bar)`
+# survive, while the closing `)` of a markdown `[text](url)` and the backticks
+# around inline code are left out.
+URL_PATTERN = re.compile(
+    rb'https?://(?:[^\s<>"\'`()\[\]]|\([^\s<>"\'`()\[\]]*\))+'
+)
+
+# Punctuation that ends a sentence rather than a URL
+URL_TRAILING_PUNCTUATION = '.,;:!?*'
+
+# Seconds to wait for the Jina API before giving up on a request
+REQUEST_TIMEOUT = 60
+
+# HTTP status codes worth retrying; anything else in 4xx is permanent
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised when a URL is skipped because its host's circuit is open"""
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker
+    
+    After failure_threshold consecutive URLs on a host fail with transient
+    errors the host's circuit opens and requests to it are skipped. Once
+    reset_timeout seconds have passed a single trial request is let
+    through; success closes the circuit again, failure re-opens it.
+    
+    Throttling by the Jina API itself is not the origin's fault, so it is
+    handled separately with pause(), which holds back requests to every
+    host. Safe to share between threads.
+    """
+    def __init__(self, failure_threshold=3, reset_timeout=300):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = {}
+        self.opened_at = {}
+        self.paused_until = 0
+        self.lock = threading.Lock()
+        
+    def is_open(self, host):
+        """Return True if requests to host are currently being skipped"""
+        opened_at = self.opened_at.get(host)
+        return opened_at is not None and time.monotonic() - opened_at < self.reset_timeout
+        
+    def allow_request(self, host):
+        """
+        Check whether a request to host may be made
+        
+        Returns:
+            tuple: (allowed, trial) where trial is True for the single
+                request let through while the circuit is half-open
+        """
+        with self.lock:
+            if self.is_open(host):
+                return False, False
+            if host in self.opened_at:
+                # Half-open: let one trial through and hold the rest until it reports
+                self.opened_at[host] = time.monotonic()
+                return True, True
+            return True, False
+        
+    def pause(self, seconds):
+        """Hold back requests to every host for at least seconds"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            
+    def paused_for(self):
+        """Return seconds left before requests may be made again"""
+        return max(self.paused_until - time.monotonic(), 0)
+        
+    def time_until_retry(self, host):
+        """Return seconds until host's open circuit lets a trial request through"""
+        opened_at = self.opened_at.get(host)
+        if opened_at is None:
+            return 0
+        return max(opened_at + self.reset_timeout - time.monotonic(), 0)
+        
+    def record_success(self, host):
+        """Close the circuit for host"""
+        with self.lock:
+            self.failures.pop(host, None)
+            self.opened_at.pop(host, None)
+        
+    def record_failure(self, host):
+        """Count a transient failure for host, opening the circuit at the threshold"""
+        with self.lock:
+            self.failures[host] = self.failures.get(host, 0) + 1
+            if self.failures[host] >= self.failure_threshold:
+                if host not in self.opened_at:
+                    logging.warning(f"Circuit opened for {host} after {self.failures[host]} failures")
+                self.opened_at[host] = time.monotonic()
+
+class HostScheduler:
+    """
+    Hand out URLs round-robin across hosts
+    
+    A host is only handed another URL while fewer than per_host_limit of
+    its URLs are in flight and at least min_spacing seconds have passed
+    since its last one started, so long runs of one host in the input are
+    spread out between the other hosts.
+    """
+    def __init__(self, items, per_host_limit=1, min_spacing=1):
+        if per_host_limit < 1:
+            raise ValueError(f"per_host_limit must be at least 1, got {per_host_limit}")
+        self.per_host_limit = per_host_limit
+        self.min_spacing = min_spacing
+        self.queues = OrderedDict()
+        self.active = {}
+        self.last_start = {}
+        for key, url in items:
+            self.queues.setdefault(urlparse(url).netloc, deque()).append((key, url))
+            
+    def __bool__(self):
+        return bool(self.queues)
+        
+    def next_ready(self):
+        """
+        Take the next URL whose host may be contacted now
+        
+        Returns:
+            tuple: ((key, url), None) when a URL is ready, otherwise
+                (None, seconds until one may be) or (None, None) if every
+                host with URLs left is at its concurrency limit
+        """
+        now = time.monotonic()
+        wait_time = None
+        for host, queue in self.queues.items():
+            if self.active.get(host, 0) >= self.per_host_limit:
+                continue
+            ready_at = self.last_start.get(host, now - self.min_spacing) + self.min_spacing
+            if ready_at > now:
+                wait_time = ready_at - now if wait_time is None else min(wait_time, ready_at - now)
+                continue
+            item = queue.popleft()
+            if queue:
+                # Rotate the host to the back so the others get their turn
+                self.queues.move_to_end(host)
+            else:
+                del self.queues[host]
+            self.active[host] = self.active.get(host, 0) + 1
+            self.last_start[host] = now
+            return item, None
+        return None, wait_time
+        
+    def release(self, url):
+        """Mark a URL handed out by next_ready as finished"""
+        self.active[urlparse(url).netloc] -= 1
+        
+    def drain(self, host):
+        """Remove and return every URL still queued for host"""
+        return list(self.queues.pop(host, ()))
+
+def positive_int(value):
+    """
+    Parse a command line value that must be a whole number of at least 1
+    
+    Args:
+        value (str): Raw argument value
+        
+    Returns:
+        int: Parsed value
+        
+    Raises:
+        argparse.ArgumentTypeError: If the value is not a positive integer
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid integer: {value}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1: {value}")
+    return number
+
 def setup_logging():
     """Configure logging for the script"""
     logging.basicConfig(
@@ -65,6 +249,53 @@ def extract_links(html_content, base_url=''):
         logging.error(f"Error parsing HTML: {e}")
         raise
 
+def scan_urls_file(file_path):
+    """
+    Scan a markdown, plain text or fetched content file for URLs
+    
+    The file is memory-mapped and scanned with a compiled pattern in a
+    single pass, so memory use stays constant regardless of file size.
+    
+    Args:
+        file_path (str): Path to the file to scan
+        
+    Yields:
+        str: Each URL in the order it appears (duplicates included)
+        
+    Raises:
+        FileNotFoundError: If the file doesn't exist
+        IOError: If there's an error reading the file
+    """
+    try:
+        with open(file_path, 'rb') as file:
+            # mmap refuses zero-length files
+            if Path(file_path).stat().st_size == 0:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for match in URL_PATTERN.finditer(data):
+                    url = match.group().decode('utf-8', errors='replace')
+                    url = url.rstrip(URL_TRAILING_PUNCTUATION)
+                    if url:
+                        yield url
+    except FileNotFoundError:
+        logging.error(f"File not found: {file_path}")
+        raise
+    except (IOError, ValueError) as e:
+        logging.error(f"Error reading file: {e}")
+        raise
+
+def extract_text_links(file_path):
+    """
+    Extract all links from a markdown, plain text or fetched content file
+    
+    Args:
+        file_path (str): Path to the file to scan
+        
+    Returns:
+        set: Set of unique URLs found in the file
+    """
+    return set(scan_urls_file(file_path))
+
 def save_links(links, output_file):
     """
     Save extracted links to a text file
@@ -82,82 +313,366 @@ def save_links(links, output_file):
         logging.error(f"Error writing to output file: {e}")
         raise
 
-def fetch_url_content(url, api_key):
+def request_url_content(url, api_key, timeout=REQUEST_TIMEOUT):
     """
-    Fetch content from URL using the Jina API
+    Request content from URL using the Jina API
     
     Args:
         url (str): URL to fetch
         api_key (str): Jina API key
+        timeout (float): Seconds to wait for the API to respond
+        
+    Returns:
+        str: Response content
+        
+    Raises:
+        requests.exceptions.RequestException: If the request fails
+    """
+    jina_url = f'https://r.jina.ai/{url}'
+    headers = {'Authorization': f'Bearer {api_key}'}
+    response = requests.get(jina_url, headers=headers, timeout=timeout)
+    response.raise_for_status()
+    return response.text
+
+def is_retryable_error(error):
+    """
+    Classify a request error as transient or permanent
+    
+    Args:
+        error (requests.exceptions.RequestException): Error raised by a request
         
     Returns:
-        str: Response content or error message
+        bool: True if the request may succeed when retried
     """
+    if isinstance(error, (CircuitOpenError, requests.exceptions.ConnectionError,
+                          requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return error.response.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+def is_api_throttle(error):
+    """
+    Tell whether a request error is the Jina API's own rate limit
+    
+    Args:
+        error (requests.exceptions.RequestException): Error raised by a request
+        
+    Returns:
+        bool: True for a 429 response
+    """
+    response = getattr(error, 'response', None)
+    return response is not None and response.status_code == 429
+
+def retry_after_seconds(error):
+    """
+    Read the server's Retry-After header from a failed request
+    
+    Args:
+        error (requests.exceptions.RequestException): Error from the last attempt
+        
+    Returns:
+        float: Seconds the server asked us to wait, or None if it didn't say
+    """
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    retry_after = response.headers.get('Retry-After', '').strip()
+    if retry_after.isdigit():
+        return float(retry_after)
     try:
-        jina_url = f'https://r.jina.ai/{url}'
-        headers = {'Authorization': f'Bearer {api_key}'}
-        response = requests.get(jina_url, headers=headers)
-        response.raise_for_status()
-        return response.text
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error fetching URL {url}: {e}")
-        return f"Error fetching URL: {str(e)}"
+        # HTTP-date form, e.g. "Wed, 21 Oct 2015 07:28:00 GMT"
+        retry_at = parsedate_to_datetime(retry_after)
+        if retry_at.tzinfo is None:
+            # A "-0000" offset parses as naive; HTTP dates are always UTC
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return None
+
+def retry_delay(attempt, error, backoff_base, backoff_max):
+    """
+    Compute how long to wait before the next attempt
+    
+    Uses exponential backoff with full jitter, raised to the server's
+    Retry-After value when one is given. Only a Retry-After value can make
+    the delay exceed backoff_max.
+    
+    Args:
+        attempt (int): Number of attempts made so far
+        error (requests.exceptions.RequestException): Error from the last attempt
+        backoff_base (float): Delay in seconds for the first retry
+        backoff_max (float): Upper bound for the backoff delay
+        
+    Returns:
+        float: Seconds to wait
+    """
+    delay = random.uniform(0, min(backoff_max, backoff_base * 2 ** (attempt - 1)))
+    retry_after = retry_after_seconds(error)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+def fetch_with_retry(url, api_key, breaker, max_retries=3, backoff_base=1, backoff_max=30):
+    """
+    Fetch content from URL, retrying transient errors
+    
+    The circuit breaker is told about a URL once, when it succeeds or gives
+    up, so a single bad page cannot open the circuit for its whole host. A
+    429 comes from the Jina API's own rate limit rather than the origin, so
+    it pauses requests to every host instead of counting against this one.
+    
+    Args:
+        url (str): URL to fetch
+        api_key (str): Jina API key
+        breaker (CircuitBreaker): Circuit breaker shared across URLs
+        max_retries (int): Retries after the first attempt for transient errors
+        backoff_base (float): Delay in seconds for the first retry
+        backoff_max (float): Longest delay to wait before giving up; a longer
+            Retry-After ends the retries, except on a 429
+        
+    Returns:
+        str: Response content
+        
+    Raises:
+        CircuitOpenError: If the URL's host circuit is open
+        requests.exceptions.RequestException: If the error is permanent or
+            retries are exhausted
+    """
+    host = urlparse(url).netloc
+    allowed, trial = breaker.allow_request(host)
+    if not allowed:
+        raise CircuitOpenError(f"circuit open for {host}")
+    attempt = 0
+    while True:
+        attempt += 1
+        time.sleep(breaker.paused_for())
+        try:
+            content = request_url_content(url, api_key)
+            breaker.record_success(host)
+            return content
+        except requests.exceptions.RequestException as e:
+            if not is_retryable_error(e):
+                # The host answered, so a permanent error says nothing about its health
+                if getattr(e, 'response', None) is not None:
+                    breaker.record_success(host)
+                raise
+            throttled = is_api_throttle(e)
+            if throttled and attempt > max_retries:
+                raise
+            # Stop early if other URLs have opened the circuit meanwhile; the
+            # half-open trial holds the circuit open itself, so it keeps retrying
+            if not throttled and (attempt > max_retries or (not trial and breaker.is_open(host))):
+                breaker.record_failure(host)
+                raise
+            delay = retry_delay(attempt, e, backoff_base, backoff_max)
+            if throttled:
+                logging.warning(f"Jina API throttled {url}, pausing all requests for {delay:.1f}s")
+                breaker.pause(delay)
+                continue
+            if delay > backoff_max:
+                logging.warning(f"Attempt {attempt} for {url} failed ({e}), "
+                                f"server asked to wait {delay:.0f}s, giving up")
+                breaker.record_failure(host)
+                raise
+            logging.warning(f"Attempt {attempt} for {url} failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
 
-def process_links_file(input_file, output_file, api_key):
+def fetch_scheduled(items, api_key, breaker, max_retries=3, max_workers=4, per_host_limit=1,
+                    host_delay=1):
+    """
+    Fetch URLs concurrently, interleaving hosts
+    
+    Results are yielded as they complete, not in input order. URLs for a
+    host whose circuit has opened are yielded with a CircuitOpenError
+    without waiting for their turn.
+    
+    Args:
+        items (iterable): (key, url) pairs; key is passed back with the result
+        api_key (str): Jina API key
+        breaker (CircuitBreaker): Circuit breaker shared across URLs
+        max_retries (int): Retries per URL for transient errors
+        max_workers (int): Maximum requests in flight overall
+        per_host_limit (int): Maximum requests in flight per host
+        host_delay (float): Minimum seconds between request starts per host
+        
+    Yields:
+        tuple: (key, url, content, error) with exactly one of content and
+            error set
+    """
+    scheduler = HostScheduler(items, per_host_limit, host_delay)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while running or scheduler:
+            for host in [host for host in scheduler.queues if breaker.is_open(host)]:
+                for key, url in scheduler.drain(host):
+                    yield key, url, None, CircuitOpenError(f"circuit open for {host}")
+            
+            wait_time = breaker.paused_for() or None
+            # While the Jina API is throttling us nothing new is started
+            while wait_time is None and len(running) < max_workers:
+                item, wait_time = scheduler.next_ready()
+                if item is None:
+                    break
+                key, url = item
+                future = executor.submit(fetch_with_retry, url, api_key, breaker, max_retries)
+                running[future] = item
+                
+            if not running:
+                if wait_time is not None:
+                    time.sleep(wait_time)
+                continue
+                
+            done, _ = wait(running, timeout=wait_time, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, url = running.pop(future)
+                scheduler.release(url)
+                try:
+                    yield key, url, future.result(), None
+                except requests.exceptions.RequestException as e:
+                    yield key, url, None, e
+
+def format_divider(index, url):
+    """
+    Build the divider written before each URL's content
+    
+    Args:
+        index (int): 1-based position of the URL in the links file
+        url (str): URL the content belongs to
+        
+    Returns:
+        str: Divider text
+    """
+    return f"\n{'='*80}\nURL {index}: {url}\n{'='*80}\n"
+
+def process_links_file(input_file, output_file, api_key, dead_letter_file=None, max_retries=3,
+                       max_workers=4, per_host_limit=1, host_delay=1):
     """
     Process links from input file and save responses to output file
     
+    URLs are fetched concurrently and interleaved across hosts, with at most
+    per_host_limit requests in flight and host_delay seconds between request
+    starts for any one host. Each response is written to a spool file next
+    to output_file as soon as it arrives, so responses are not held in
+    memory; the spool is then copied into output_file in input order and
+    removed.
+    
+    Transient errors are retried with backoff, and hosts that keep failing
+    are skipped by a circuit breaker. URLs that could not be fetched are
+    written to the dead-letter file, one per line, so it can be fed back in
+    as an input file later.
+    
     Args:
         input_file (str): Path to file containing URLs
         output_file (str): Path to save fetched content
         api_key (str): Jina API key
+        dead_letter_file (str): Path to save URLs that could not be fetched
+        max_retries (int): Retries per URL for transient errors
+        max_workers (int): Maximum requests in flight overall
+        per_host_limit (int): Maximum requests in flight per host
+        host_delay (float): Minimum seconds between request starts per host
     """
     try:
         # Read URLs from input file
         with open(input_file, 'r', encoding='utf-8') as f:
             urls = [line.strip() for line in f if line.strip()]
         
-        # Process each URL and save responses
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for i, url in enumerate(urls, 1):
-                logging.info(f"Processing URL {i}/{len(urls)}: {url}")
-                
-                # Add divider
-                divider = f"\n{'='*80}\nURL {i}: {url}\n{'='*80}\n"
-                f.write(divider)
-                
-                # Fetch and save content
-                content = fetch_url_content(url, api_key)
-                f.write(content + "\n")
-                
-                # Add small delay to avoid overwhelming the API
-                time.sleep(1)
+        breaker = CircuitBreaker()
+        spool_file = f"{output_file}.partial"
+        # Byte range of each URL's divider and content in the spool file
+        spans = {}
+        failed = []
+        
+        try:
+            # Fetch URLs and spool responses in the order they complete
+            with open(spool_file, 'wb') as spool:
+                fetched = fetch_scheduled(enumerate(urls, 1), api_key, breaker, max_retries,
+                                          max_workers, per_host_limit, host_delay)
+                for completed, (i, url, content, error) in enumerate(fetched, 1):
+                    if error is None:
+                        logging.info(f"Processed URL {completed}/{len(urls)}: {url}")
+                    elif isinstance(error, CircuitOpenError):
+                        logging.warning(f"Skipping URL {url}: {error}")
+                    else:
+                        logging.error(f"Error fetching URL {url}: {error}")
+                    if error is not None:
+                        content = f"Error fetching URL: {str(error)}"
+                        failed.append(i)
+                    
+                    # Add divider
+                    data = (format_divider(i, url) + content + "\n").encode('utf-8')
+                    spans[i] = (spool.tell(), len(data))
+                    spool.write(data)
+            
+            # Copy the spooled responses into the output file in input order; text
+            # mode gives the platform's line endings like the rest of the tool
+            with open(spool_file, 'rb') as spool, open(output_file, 'w', encoding='utf-8') as f:
+                for i in range(1, len(urls) + 1):
+                    offset, length = spans[i]
+                    spool.seek(offset)
+                    f.write(spool.read(length).decode('utf-8'))
+        finally:
+            if os.path.exists(spool_file):
+                os.remove(spool_file)
                 
         logging.info(f"Successfully processed {len(urls)} URLs and saved to {output_file}")
+        
+        if dead_letter_file:
+            # Keep dead letters in input order like the content file
+            save_dead_letters([urls[i - 1] for i in sorted(failed)], dead_letter_file)
     except Exception as e:
         logging.error(f"Error processing links: {e}")
         raise
 
+def save_dead_letters(urls, dead_letter_file):
+    """
+    Save URLs that could not be fetched so they can be re-fed later
+    
+    Args:
+        urls (list): URLs in the order they were processed
+        dead_letter_file (str): Path to the dead-letter file
+    """
+    try:
+        with open(dead_letter_file, 'w', encoding='utf-8') as file:
+            for url in urls:
+                file.write(f"{url}\n")
+        if urls:
+            logging.warning(f"Saved {len(urls)} failed URLs to {dead_letter_file}")
+    except IOError as e:
+        logging.error(f"Error writing dead-letter file: {e}")
+        raise
+
 def main():
     """Main function to run the link extractor"""
     # Set up argument parser
     parser = argparse.ArgumentParser(description='Extract links from HTML file and fetch their content')
-    parser.add_argument('input_file', help='Path to input HTML file')
+    parser.add_argument('input_file', help='Path to input HTML, markdown or text file')
     parser.add_argument('output_file', help='Path to output text file for links')
     parser.add_argument('--base-url', help='Base URL for relative links', default='')
+    parser.add_argument('--input-format', help='Format of the input file (text covers markdown, plain text and fetched content dumps)',
+                        choices=['html', 'text'], default='html')
     parser.add_argument('--api-key', help='Jina API key', required=True)
     parser.add_argument('--fetch-content', help='Fetch content for extracted links', action='store_true')
+    parser.add_argument('--max-retries', help='Retries per URL for transient errors', type=int, default=3)
+    parser.add_argument('--dead-letter-file', help='Path to save URLs that could not be fetched', default='dead_letters.txt')
+    parser.add_argument('--max-workers', help='Maximum requests in flight overall', type=positive_int, default=4)
+    parser.add_argument('--per-host-limit', help='Maximum requests in flight per host', type=positive_int, default=1)
+    parser.add_argument('--host-delay', help='Minimum seconds between requests to the same host', type=float, default=1)
     
     args = parser.parse_args()
     
     setup_logging()
     
     try:
-        # Read HTML file
-        html_content = read_html_file(args.input_file)
-        
-        # Extract links
-        links = extract_links(html_content, args.base_url)
+        if args.input_format == 'text':
+            # Scan markdown/text input for URLs
+            links = extract_text_links(args.input_file)
+        else:
+            # Read HTML file
+            html_content = read_html_file(args.input_file)
+            
+            # Extract links
+            links = extract_links(html_content, args.base_url)
         
         # Save links to output file
         save_links(links, args.output_file)
@@ -165,7 +680,9 @@ def main():
         # If fetch-content flag is set, process the links
         if args.fetch_content:
             fetched_content_file = 'fetched_content.txt'
-            process_links_file(args.output_file, fetched_content_file, args.api_key)
+            process_links_file(args.output_file, fetched_content_file, args.api_key,
+                               args.dead_letter_file, args.max_retries, args.max_workers,
+                               args.per_host_limit, args.host_delay)
         
     except Exception as e:
         logging.error(f"Script execution failed: {e}")
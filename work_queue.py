@@ -0,0 +1,411 @@
+import argparse
+import logging
+import sqlite3
+import time
+import uuid
+
+from urllib.parse import urlparse
+
+from link_extractor import (setup_logging, format_divider, fetch_scheduled, is_retryable_error,
+                            save_dead_letters, positive_int, CircuitBreaker, CircuitOpenError)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS urls (
+    position INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    host TEXT NOT NULL,
+    host_rank INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    lease_token TEXT,
+    lease_expires REAL,
+    not_before REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    content TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS urls_lease ON urls (status, host_rank, position);
+"""
+
+def connect_queue(db_path):
+    """
+    Open the SQLite work queue, creating the schema if needed
+
+    Args:
+        db_path (str): Path to the SQLite queue file
+
+    Returns:
+        sqlite3.Connection: Connection in autocommit mode
+    """
+    # Autocommit mode so transactions are opened explicitly with BEGIN IMMEDIATE
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    # WAL lets workers write while the merge step or other workers read
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+def init_queue(db_path, links_file):
+    """
+    Load URLs from a links file into the work queue
+
+    Positions follow the line order of the links file. URLs that are
+    already queued are left as they are and new ones are appended after
+    them, so re-running init on the same or an edited file is safe. Each
+    URL is also ranked within its host so batches can be leased
+    round-robin across hosts.
+
+    Args:
+        db_path (str): Path to the SQLite queue file
+        links_file (str): Path to file containing URLs, one per line
+
+    Returns:
+        int: Number of URLs in the queue
+    """
+    try:
+        conn = connect_queue(db_path)
+        with open(links_file, 'r', encoding='utf-8') as f:
+            conn.execute('BEGIN IMMEDIATE')
+            host_counts = dict(conn.execute('SELECT host, MAX(host_rank) FROM urls GROUP BY host'))
+
+            def rows():
+                for line in f:
+                    url = line.strip()
+                    if url:
+                        host = urlparse(url).netloc
+                        host_counts[host] = host_counts.get(host, 0) + 1
+                        yield url, host, host_counts[host]
+
+            # position is the rowid, so each new URL is numbered after the last one
+            conn.executemany('INSERT OR IGNORE INTO urls (url, host, host_rank) VALUES (?, ?, ?)', rows())
+            conn.execute('COMMIT')
+        total = conn.execute('SELECT COUNT(*) FROM urls').fetchone()[0]
+        conn.close()
+        logging.info(f"Queued {total} URLs in {db_path}")
+        return total
+    except (IOError, sqlite3.Error) as e:
+        logging.error(f"Error initializing work queue: {e}")
+        raise
+
+def lease_batch(conn, batch_size, lease_timeout):
+    """
+    Lease a batch of pending or expired URLs
+
+    URLs are taken by rank within their host, so a batch holds the first
+    URL of each host before the second of any, instead of a run of one
+    host from a sorted links file. Concurrent workers likewise tend to be
+    spread over different hosts.
+
+    Args:
+        conn (sqlite3.Connection): Queue connection
+        batch_size (int): Maximum number of URLs to lease
+        lease_timeout (float): Seconds before the lease expires and the URLs
+            become available to other workers again
+
+    Returns:
+        tuple: (lease token, list of (position, url) tuples)
+    """
+    token = uuid.uuid4().hex
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rows = conn.execute(
+            "SELECT position, url FROM urls"
+            " WHERE (status = 'pending' AND (not_before IS NULL OR not_before <= ?))"
+            " OR (status = 'leased' AND lease_expires < ?)"
+            " ORDER BY host_rank, position LIMIT ?",
+            (now, now, batch_size)
+        ).fetchall()
+        conn.executemany(
+            "UPDATE urls SET status = 'leased', lease_token = ?, lease_expires = ?,"
+            " attempts = attempts + 1 WHERE position = ?",
+            [(token, now + lease_timeout, position) for position, _ in rows]
+        )
+        conn.execute('COMMIT')
+    except sqlite3.Error:
+        conn.execute('ROLLBACK')
+        raise
+    return token, rows
+
+def renew_lease(conn, token, lease_timeout):
+    """
+    Extend the lease on the URLs of a batch that are still being fetched
+
+    Args:
+        conn (sqlite3.Connection): Queue connection
+        token (str): Lease token returned by lease_batch
+        lease_timeout (float): Seconds from now before the lease expires
+
+    Returns:
+        int: Number of URLs whose lease was extended
+    """
+    cursor = conn.execute(
+        "UPDATE urls SET lease_expires = ? WHERE status = 'leased' AND lease_token = ?",
+        (time.time() + lease_timeout, token)
+    )
+    return cursor.rowcount
+
+def complete_url(conn, position, token, content):
+    """
+    Mark a leased URL as done and store its content
+
+    Args:
+        conn (sqlite3.Connection): Queue connection
+        position (int): Position of the URL in the queue
+        token (str): Lease token returned by lease_batch
+        content (str): Fetched content
+
+    Returns:
+        bool: False if the lease expired and was taken by another worker
+    """
+    cursor = conn.execute(
+        "UPDATE urls SET status = 'done', content = ?, error = NULL, lease_token = NULL"
+        " WHERE position = ? AND lease_token = ?",
+        (content, position, token)
+    )
+    return cursor.rowcount == 1
+
+def fail_url(conn, position, token, error, max_attempts):
+    """
+    Record a failed fetch, re-queueing the URL until max_attempts is reached
+
+    Args:
+        conn (sqlite3.Connection): Queue connection
+        position (int): Position of the URL in the queue
+        token (str): Lease token returned by lease_batch
+        error (str): Error message
+        max_attempts (int): Attempts after which the URL is marked failed
+
+    Returns:
+        bool: False if the lease expired and was taken by another worker
+    """
+    cursor = conn.execute(
+        "UPDATE urls SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,"
+        " error = ?, lease_token = NULL"
+        " WHERE position = ? AND lease_token = ?",
+        (max_attempts, error, position, token)
+    )
+    return cursor.rowcount == 1
+
+def defer_url(conn, position, token, delay):
+    """
+    Return a leased URL to the queue without using up an attempt
+
+    Used for URLs skipped because their host's circuit is open. The error
+    from the last real attempt is kept.
+
+    Args:
+        conn (sqlite3.Connection): Queue connection
+        position (int): Position of the URL in the queue
+        token (str): Lease token returned by lease_batch
+        delay (float): Seconds before the URL may be leased again
+
+    Returns:
+        bool: False if the lease expired and was taken by another worker
+    """
+    cursor = conn.execute(
+        "UPDATE urls SET status = 'pending', attempts = attempts - 1, not_before = ?,"
+        " lease_token = NULL WHERE position = ? AND lease_token = ?",
+        (time.time() + delay, position, token)
+    )
+    return cursor.rowcount == 1
+
+def next_available(conn):
+    """
+    Return the earliest time an unfinished URL may become leasable
+
+    Args:
+        conn (sqlite3.Connection): Queue connection
+
+    Returns:
+        float: Timestamp of the earliest lease expiry or deferral, or None
+            if nothing is leased or deferred
+    """
+    return conn.execute(
+        "SELECT MIN(CASE WHEN status = 'leased' THEN lease_expires ELSE not_before END)"
+        " FROM urls WHERE status = 'leased' OR (status = 'pending' AND not_before IS NOT NULL)"
+    ).fetchone()[0]
+
+def run_worker(db_path, api_key, batch_size=10, lease_timeout=600, max_attempts=3, delay=1,
+               max_retries=3, max_workers=4, per_host_limit=1, poll_interval=5):
+    """
+    Fetch URLs from the work queue until nothing is left to lease
+
+    While other workers still hold leases the worker polls the queue, so
+    URLs they re-queue or leave behind by crashing are picked up. The lease
+    on a batch is renewed each time one of its URLs finishes. Permanent
+    errors mark a URL failed straight away; transient ones re-queue it.
+    URLs skipped by an open circuit are deferred until it may close.
+
+    per_host_limit and delay only apply within this worker: with N workers
+    a host may see up to N times as many requests. Leasing round-robin
+    across hosts keeps that rare, but it is not a global limit.
+    Each batch is fetched concurrently and interleaved across hosts.
+
+    Args:
+        db_path (str): Path to the SQLite queue file
+        api_key (str): Jina API key
+        batch_size (int): Number of URLs leased at a time
+        lease_timeout (float): Seconds a lease is held before it expires
+        max_attempts (int): Attempts per URL before it is marked failed
+        delay (float): Minimum seconds between requests to the same host
+        max_retries (int): In-process retries per attempt for transient errors
+        max_workers (int): Maximum requests in flight overall
+        per_host_limit (int): Maximum requests in flight per host
+        poll_interval (float): Seconds between polls while other workers hold leases
+
+    Returns:
+        int: Number of URLs this worker processed
+    """
+    conn = connect_queue(db_path)
+    breaker = CircuitBreaker()
+    processed = 0
+    try:
+        while True:
+            token, batch = lease_batch(conn, batch_size, lease_timeout)
+            if not batch:
+                available_at = next_available(conn)
+                if available_at is None:
+                    break
+                # Other workers hold the rest or hosts are cooling down; poll for
+                # re-queued, expired or deferred URLs
+                time.sleep(min(max(available_at - time.time(), 0) + 0.1, poll_interval))
+                continue
+
+            fetched = fetch_scheduled(batch, api_key, breaker, max_retries, max_workers,
+                                      per_host_limit, delay)
+            for position, url, content, error in fetched:
+                if error is None:
+                    logging.info(f"Processed URL {position}: {url}")
+                    kept = complete_url(conn, position, token, content)
+                elif isinstance(error, CircuitOpenError):
+                    logging.warning(f"Deferring URL {url}: {error}")
+                    cooldown = breaker.time_until_retry(urlparse(url).netloc)
+                    kept = defer_url(conn, position, token, cooldown)
+                else:
+                    logging.error(f"Error fetching URL {url}: {error}")
+                    attempts_allowed = max_attempts if is_retryable_error(error) else 0
+                    kept = fail_url(conn, position, token, str(error), attempts_allowed)
+                if not kept:
+                    logging.warning(f"Lease expired for URL {position}, result discarded")
+                processed += 1
+                renew_lease(conn, token, lease_timeout)
+
+        logging.info(f"Worker finished after processing {processed} URLs")
+        return processed
+    finally:
+        conn.close()
+
+def queue_status(db_path):
+    """
+    Count queued URLs by status
+
+    Args:
+        db_path (str): Path to the SQLite queue file
+
+    Returns:
+        dict: Mapping of status to number of URLs
+    """
+    conn = connect_queue(db_path)
+    try:
+        return dict(conn.execute('SELECT status, COUNT(*) FROM urls GROUP BY status'))
+    finally:
+        conn.close()
+
+def merge_queue(db_path, output_file, allow_partial=False, dead_letter_file=None):
+    """
+    Write fetched content from the work queue to a single ordered file
+
+    The output matches the format written by process_links_file.
+
+    Args:
+        db_path (str): Path to the SQLite queue file
+        output_file (str): Path to save fetched content
+        allow_partial (bool): Write pending URLs as errors instead of failing
+        dead_letter_file (str): Path to save URLs that could not be fetched
+
+    Raises:
+        ValueError: If URLs are still pending and allow_partial is False
+    """
+    counts = queue_status(db_path)
+    unfinished = counts.get('pending', 0) + counts.get('leased', 0)
+    if unfinished and not allow_partial:
+        raise ValueError(f"{unfinished} URLs have not been fetched yet")
+
+    conn = connect_queue(db_path)
+    dead_letters = []
+    try:
+        rows = conn.execute('SELECT position, url, status, content, error FROM urls ORDER BY position')
+        with open(output_file, 'w', encoding='utf-8') as f:
+            for position, url, status, content, error in rows:
+                f.write(format_divider(position, url))
+                if status == 'done':
+                    f.write(content + "\n")
+                elif status == 'failed':
+                    f.write(f"Error fetching URL: {error}\n")
+                    dead_letters.append(url)
+                else:
+                    f.write("Error fetching URL: not fetched yet\n")
+                    dead_letters.append(url)
+        logging.info(f"Successfully merged {sum(counts.values())} URLs into {output_file}")
+
+        if dead_letter_file:
+            save_dead_letters(dead_letters, dead_letter_file)
+    except (IOError, sqlite3.Error) as e:
+        logging.error(f"Error merging work queue: {e}")
+        raise
+    finally:
+        conn.close()
+
+def main():
+    """Main function to run the work queue commands"""
+    parser = argparse.ArgumentParser(description='Fetch URL content with several workers sharing a SQLite work queue')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    init_parser = subparsers.add_parser('init', help='Load URLs from a links file into the queue')
+    init_parser.add_argument('queue_db', help='Path to SQLite queue file')
+    init_parser.add_argument('links_file', help='Path to file containing URLs')
+
+    work_parser = subparsers.add_parser('work', help='Fetch queued URLs until the queue is drained')
+    work_parser.add_argument('queue_db', help='Path to SQLite queue file')
+    work_parser.add_argument('--api-key', help='Jina API key', required=True)
+    work_parser.add_argument('--batch-size', help='URLs leased at a time', type=int, default=10)
+    work_parser.add_argument('--lease-timeout', help='Seconds before a lease expires; renewed each time a URL in the batch finishes', type=float, default=600)
+    work_parser.add_argument('--max-attempts', help='Attempts per URL before it is marked failed', type=int, default=3)
+    work_parser.add_argument('--delay', help='Minimum seconds between requests to the same host (per worker process)',
+                             type=float, default=1)
+    work_parser.add_argument('--max-retries', help='In-process retries per attempt for transient errors', type=int, default=3)
+    work_parser.add_argument('--max-workers', help='Maximum requests in flight overall', type=positive_int, default=4)
+    work_parser.add_argument('--per-host-limit', help='Maximum requests in flight per host (per worker process)',
+                             type=positive_int, default=1)
+    work_parser.add_argument('--poll-interval', help='Seconds between polls while other workers hold leases', type=float, default=5)
+
+    status_parser = subparsers.add_parser('status', help='Show URL counts by status')
+    status_parser.add_argument('queue_db', help='Path to SQLite queue file')
+
+    merge_parser = subparsers.add_parser('merge', help='Write fetched content to an ordered output file')
+    merge_parser.add_argument('queue_db', help='Path to SQLite queue file')
+    merge_parser.add_argument('output_file', help='Path to save fetched content')
+    merge_parser.add_argument('--partial', help='Merge even if some URLs are not fetched yet', action='store_true')
+    merge_parser.add_argument('--dead-letter-file', help='Path to save URLs that could not be fetched', default='dead_letters.txt')
+
+    args = parser.parse_args()
+
+    setup_logging()
+
+    try:
+        if args.command == 'init':
+            init_queue(args.queue_db, args.links_file)
+        elif args.command == 'work':
+            run_worker(args.queue_db, args.api_key, args.batch_size, args.lease_timeout,
+                       args.max_attempts, args.delay, args.max_retries, args.max_workers,
+                       args.per_host_limit, args.poll_interval)
+        elif args.command == 'status':
+            for status, count in sorted(queue_status(args.queue_db).items()):
+                print(f"{status}: {count}")
+        elif args.command == 'merge':
+            merge_queue(args.queue_db, args.output_file, args.partial, args.dead_letter_file)
+    except Exception as e:
+        logging.error(f"Work queue command failed: {e}")
+        exit(1)
+
+if __name__ == '__main__':
+    main()